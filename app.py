@@ -3,19 +3,26 @@
 ########################################################
 
 import streamlit as st
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Index, DDL, event, inspect, or_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm.attributes import NO_VALUE
 from datetime import datetime, date
 import pandas as pd
 import re
+import sqlite3
+import json
 import streamlit_shadcn_ui as ui
 from st_aggrid import AgGrid
 from itables.streamlit import interactive_table
+from database import (
+    DB_PATH, SNAPSHOT_PATH, creer_snapshot, sauvegarde_a_chaud, age_snapshot, demarrer_snapshots_planifies,
+    enfiler_audit, audit_evenements_perdus, demarrer_audit,
+)
 # --------------------- Configuration de SQLAlchemy ---------------------
 
 Base = declarative_base()
-engine = create_engine('sqlite:///keys.db', echo=True)
+engine = create_engine(f'sqlite:///{DB_PATH}', echo=True)
 Session = sessionmaker(bind=engine)
 
 # --------------------- Modèles ---------------------
@@ -61,9 +68,146 @@ class Emprunt(Base):
     cle = relationship("Cle", back_populates="emprunts")
     emprunteur = relationship("Emprunteur", back_populates="emprunts")
 
+class AuditLog(Base):
+    __tablename__ = 'audit'
+    id = Column(Integer, primary_key=True)
+    horodatage = Column(DateTime, nullable=False, default=datetime.now)
+    operateur = Column(String(100))
+    operation = Column(String(10), nullable=False)
+    entite = Column(String(50), nullable=False)
+    entite_id = Column(Integer, nullable=False)
+    changements = Column(Text)
+    __table_args__ = (Index('ix_audit_entite', 'entite', 'entite_id', 'horodatage'),)
+
+# Table en ajout seul : SQLite refuse toute modification ou suppression d'une ligne d'audit
+for _operation in ("UPDATE", "DELETE"):
+    event.listen(AuditLog.__table__, "after_create", DDL(
+        f"CREATE TRIGGER audit_sans_{_operation.lower()} BEFORE {_operation} ON audit "
+        f"BEGIN SELECT RAISE(ABORT, 'La table audit est en ajout seul'); END"
+    ))
+
 # --------------------- Création de la Base de donnée ---------------------
 Base.metadata.create_all(engine)
 
+# --------------------- Snapshot de reporting ---------------------
+# Le snapshot est ouvert en lecture seule : les rapports ne peuvent pas y écrire
+snapshot_engine = create_engine(f'sqlite:///file:{SNAPSHOT_PATH}?mode=ro&uri=true', echo=True)
+SnapshotSession = sessionmaker(bind=snapshot_engine)
+
+
+def session_rapport(key):
+    """
+    Affiche le choix de la source des données (base ou snapshot) et retourne la session de lecture correspondante.
+    """
+    if not st.toggle("Lire depuis le snapshot de reporting", key=key):
+        return Session()
+    if age_snapshot() is None:
+        try:
+            creer_snapshot()
+        except sqlite3.Error as ex:
+            st.error(f"Erreur lors du snapshot, lecture depuis la base principale: {str(ex)}")
+            return Session()
+    age = age_snapshot()
+    date_snapshot = datetime.now() - age
+    st.caption(f"📸 Snapshot du {date_snapshot.strftime('%Y-%m-%d %H:%M')} (il y a {int(age.total_seconds() // 60)} min)")
+    return SnapshotSession()
+
+# --------------------- Journal d'audit ---------------------
+def _operateur_courant():
+    try:
+        return st.session_state.get("operateur") or "anonyme"
+    except Exception:
+        return "anonyme"
+
+
+@event.listens_for(Session, "after_flush")
+def _audit_after_flush(session, flush_context):
+    """
+    Relève les insertions, modifications et suppressions du flush. Les événements restent attachés
+    à la session jusqu'au commit, pour ne pas journaliser ce qui sera annulé par un rollback.
+    """
+    en_attente = session.info.setdefault("audit_en_attente", [])
+    operateur = _operateur_courant()
+    maintenant = datetime.now()
+    for operation, objets in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objets:
+            if isinstance(obj, AuditLog):
+                continue
+            etat = inspect(obj)
+            if operation == "update":
+                changements = {}
+                for attr in etat.mapper.column_attrs:
+                    historique = etat.attrs[attr.key].history
+                    if historique.has_changes():
+                        changement = {"apres": historique.added[0] if historique.added else None}
+                        # Ancienne valeur connue seulement si l'attribut était chargé avant l'affectation :
+                        # un attribut expiré ou non chargé n'a pas d'ancienne valeur, on ne l'invente pas à NULL
+                        if historique.deleted:
+                            changement["avant"] = historique.deleted[0]
+                        elif etat.committed_state.get(attr.key, NO_VALUE) is not NO_VALUE:
+                            changement["avant"] = etat.committed_state[attr.key]
+                        changements[attr.key] = changement
+                if not changements:
+                    continue
+            else:
+                # On lit le dictionnaire de l'instance pour ne déclencher aucun chargement pendant le flush
+                changements = {attr.key: etat.dict.get(attr.key) for attr in etat.mapper.column_attrs}
+            en_attente.append({
+                "horodatage": maintenant,
+                "operateur": operateur,
+                "operation": operation,
+                "entite": etat.mapper.local_table.name,
+                "entite_id": etat.dict.get("id"),
+                "changements": json.dumps(changements, default=str, ensure_ascii=False),
+            })
+
+
+@event.listens_for(Session, "after_commit")
+def _audit_after_commit(session):
+    enfiler_audit(session.info.pop("audit_en_attente", []))
+
+
+@event.listens_for(Session, "after_rollback")
+def _audit_after_rollback(session):
+    session.info.pop("audit_en_attente", None)
+
+
+def historique_audit(cibles):
+    """
+    Historique des modifications, du plus récent au plus ancien.
+    `cibles` associe un nom de table à une liste d'identifiants, ex: {"salles": [1], "cles": [1, 2]}.
+    """
+    filtres = [
+        (AuditLog.entite == entite) & AuditLog.entite_id.in_(ids)
+        for entite, ids in cibles.items() if ids
+    ]
+    if not filtres:
+        return pd.DataFrame()
+    session = Session()
+    try:
+        lignes = session.query(AuditLog).filter(or_(*filtres)).order_by(AuditLog.horodatage.desc()).all()
+        return pd.DataFrame([
+            {
+                "Date": a.horodatage.strftime('%Y-%m-%d %H:%M:%S'),
+                "Opérateur": a.operateur,
+                "Opération": a.operation,
+                "Table": a.entite,
+                "ID": a.entite_id,
+                "Changements": a.changements,
+            } for a in lignes
+        ])
+    finally:
+        session.close()
+
+
+def afficher_historique_audit(cibles):
+    st.subheader("Historique des modifications")
+    df_audit = historique_audit(cibles)
+    if df_audit.empty:
+        st.info("Aucune modification enregistrée.")
+    else:
+        st.dataframe(df_audit)
+
 
 ########################################################
 #                     UI DE L'APPLICATION              #
@@ -77,7 +221,7 @@ def page_dashboard():
     """
     st.title("📊 Tableau de bord")
 
-    session = Session()
+    session = session_rapport("snapshot_dashboard")
 
     # Quelques statistiques globales
     total_salles = session.query(Salle).count()
@@ -293,6 +437,12 @@ def page_detail_salle():
     else:
         st.info("Aucune clé enregistrée pour cette salle.")
 
+    afficher_historique_audit({
+        "salles": [salle.id],
+        "cles": [c.id for c in salle.cles],
+        "emprunts": [e.id for c in salle.cles for e in c.emprunts],
+    })
+
     session.close()
 
 # --------------------- Page liste des Emprunteurs ---------------------
@@ -477,12 +627,17 @@ def page_detail_emprunteur():
     else:
         st.info("Aucun emprunt pour cet emprunteur.")
 
+    afficher_historique_audit({
+        "emprunteurs": [emp.id],
+        "emprunts": [e.id for e in emp.emprunts],
+    })
+
     session.close()
 
 # --------------------- Page liste des Emprunts ---------------------
 def page_liste_emprunts():
     st.title("Liste des Emprunts")
-    session = Session()
+    session = session_rapport("snapshot_liste_emprunts")
     emprunts = session.query(Emprunt).all()
     if not emprunts:
         st.info("Aucun emprunt enregistré.")
@@ -671,6 +826,17 @@ def gestion_emprunt():
 def main():
     st.set_page_config(page_title="Gestion des Salles et Emprunteurs de clé de l'ESA", layout="wide", menu_items=None, page_icon="🔑")
     st.sidebar.title("Navigation")
+    st.sidebar.text_input("Opérateur", key="operateur")
+    demarrer_snapshots_planifies()
+    demarrer_audit()
+    if audit_evenements_perdus():
+        st.sidebar.warning(f"⚠️ {audit_evenements_perdus()} événement(s) d'audit perdu(s)")
+    if st.sidebar.button("💾 Sauvegarde à chaud"):
+        try:
+            chemin = sauvegarde_a_chaud()
+            st.sidebar.success(f"Sauvegarde créée: {chemin}")
+        except (sqlite3.Error, OSError) as ex:
+            st.sidebar.error(f"Erreur lors de la sauvegarde: {str(ex)}")
     pages = {
         "📊Tableau de bord": page_dashboard,
         "🏠Gerer les salles": gestion_salle,
@@ -0,0 +1,205 @@
+########################################################
+#        RESSOURCES PARTAGÉES PAR TOUT LE PROCESSUS    #
+########################################################
+
+# Streamlit ré-exécute app.py à chaque interaction : tout ce qui doit exister une seule fois
+# par processus (verrous, threads d'arrière-plan) est défini ici, dans un module importé une seule fois.
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DB_PATH = 'keys.db'
+
+# --------------------- Snapshot de reporting et sauvegardes ---------------------
+SNAPSHOT_PATH = 'keys_rapport.db'
+SAUVEGARDES_DIR = 'sauvegardes'
+SNAPSHOT_INTERVALLE = 300  # secondes entre deux snapshots planifiés
+SNAPSHOT_PAGES_PAR_ETAPE = 256  # pages copiées à chaque étape de la sauvegarde en ligne
+
+_snapshot_lock = threading.Lock()
+_snapshot_thread = None
+_demarrage_lock = threading.Lock()
+
+
+def copier_base(destination, pages=SNAPSHOT_PAGES_PAR_ETAPE):
+    """
+    Copie keys.db vers `destination` avec l'API de sauvegarde en ligne de SQLite.
+    La copie avance par paquets de `pages` pages, ce qui laisse les guichets écrire entre deux étapes.
+    """
+    source = sqlite3.connect(DB_PATH)
+    cible = sqlite3.connect(destination)
+    try:
+        source.backup(cible, pages=pages, sleep=0.05)
+    finally:
+        cible.close()
+        source.close()
+
+
+def creer_snapshot():
+    """
+    Rafraîchit le snapshot de reporting utilisé par le tableau de bord et les listes.
+    """
+    with _snapshot_lock:
+        copier_base(SNAPSHOT_PATH)
+
+
+def sauvegarde_a_chaud():
+    """
+    Sauvegarde horodatée de keys.db sans arrêter l'application. Retourne le chemin du fichier créé.
+    """
+    os.makedirs(SAUVEGARDES_DIR, exist_ok=True)
+    # Les microsecondes évitent qu'une seconde sauvegarde dans la même seconde écrase la première
+    destination = os.path.join(SAUVEGARDES_DIR, f"keys_{datetime.now():%Y%m%d_%H%M%S_%f}.db")
+    copier_base(destination)
+    return destination
+
+
+def age_snapshot():
+    """
+    Retourne l'âge du snapshot (timedelta), ou None s'il n'a pas encore été créé.
+    """
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    return datetime.now() - datetime.fromtimestamp(os.path.getmtime(SNAPSHOT_PATH))
+
+
+def demarrer_snapshots_planifies():
+    """
+    Lance, une seule fois par processus, le thread qui rafraîchit le snapshot toutes les SNAPSHOT_INTERVALLE secondes.
+    """
+    global _snapshot_thread
+
+    def boucle():
+        while True:
+            try:
+                creer_snapshot()
+            except sqlite3.Error as ex:
+                print(f"Erreur lors du snapshot: {str(ex)}")
+            time.sleep(SNAPSHOT_INTERVALLE)
+
+    with _demarrage_lock:
+        if _snapshot_thread is None:
+            _snapshot_thread = threading.Thread(target=boucle, name="snapshot-rapport", daemon=True)
+            _snapshot_thread.start()
+    return _snapshot_thread
+
+
+# --------------------- Journal d'audit ---------------------
+AUDIT_TAILLE_FILE = 10000  # nombre maximal d'événements en attente d'écriture
+AUDIT_TAILLE_LOT = 500  # nombre maximal d'événements écrits par transaction
+AUDIT_DELAI_FLUSH = 2  # secondes d'attente maximale avant l'écriture d'un lot incomplet
+AUDIT_ESSAIS = 5  # tentatives d'écriture d'un lot avant de le compter comme perdu
+AUDIT_TIMEOUT = 30  # secondes d'attente du verrou d'écriture SQLite
+
+_audit_file = queue.Queue(maxsize=AUDIT_TAILLE_FILE)
+_audit_thread = None
+_audit_perdus = 0
+_audit_perdus_lock = threading.Lock()
+
+
+def _compter_perdus(nombre):
+    global _audit_perdus
+    with _audit_perdus_lock:
+        _audit_perdus += nombre
+
+
+def audit_evenements_perdus():
+    """
+    Nombre d'événements d'audit perdus depuis le démarrage (file pleine ou écriture impossible).
+    """
+    return _audit_perdus
+
+
+def enfiler_audit(evenements):
+    """
+    Ajoute des événements validés à la file d'écriture, sans jamais bloquer l'appelant.
+    """
+    for evenement in evenements:
+        try:
+            _audit_file.put_nowait(evenement)
+        except queue.Full:
+            _compter_perdus(1)
+
+
+def _ecrire_lot_audit(lot):
+    connexion = sqlite3.connect(DB_PATH, timeout=AUDIT_TIMEOUT)
+    try:
+        with connexion:
+            connexion.executemany(
+                "INSERT INTO audit (horodatage, operateur, operation, entite, entite_id, changements) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        e["horodatage"].strftime('%Y-%m-%d %H:%M:%S.%f'),
+                        e["operateur"], e["operation"], e["entite"], e["entite_id"], e["changements"],
+                    ) for e in lot
+                ],
+            )
+    finally:
+        connexion.close()
+
+
+def _ecrire_lot_avec_reessais(lot, essais=AUDIT_ESSAIS):
+    delai = 1
+    for essai in range(1, essais + 1):
+        try:
+            _ecrire_lot_audit(lot)
+            return
+        except sqlite3.Error as ex:
+            print(f"Erreur lors de l'écriture de l'audit (essai {essai}/{essais}): {str(ex)}")
+            if essai < essais:
+                time.sleep(delai)
+                delai *= 2
+    _compter_perdus(len(lot))
+
+
+def vider_audit():
+    """
+    Écrit immédiatement tous les événements encore en file (appelé à l'arrêt du processus).
+    """
+    lot = []
+    while True:
+        try:
+            lot.append(_audit_file.get_nowait())
+        except queue.Empty:
+            break
+        if len(lot) >= AUDIT_TAILLE_LOT:
+            _ecrire_lot_avec_reessais(lot, essais=1)
+            lot = []
+    if lot:
+        _ecrire_lot_avec_reessais(lot, essais=1)
+
+
+atexit.register(vider_audit)
+
+
+def demarrer_audit():
+    """
+    Lance, une seule fois par processus, le thread qui écrit le journal d'audit par lots.
+    """
+    global _audit_thread
+
+    def boucle():
+        while True:
+            lot = [_audit_file.get()]
+            limite = time.monotonic() + AUDIT_DELAI_FLUSH
+            while len(lot) < AUDIT_TAILLE_LOT:
+                reste = limite - time.monotonic()
+                if reste <= 0:
+                    break
+                try:
+                    lot.append(_audit_file.get(timeout=reste))
+                except queue.Empty:
+                    break
+            _ecrire_lot_avec_reessais(lot)
+
+    with _demarrage_lock:
+        if _audit_thread is None:
+            _audit_thread = threading.Thread(target=boucle, name="audit", daemon=True)
+            _audit_thread.start()
+    return _audit_thread